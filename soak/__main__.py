@@ -0,0 +1,292 @@
+"""Soak test the listener against a fake Reddit and a moto server.
+
+    python -m soak --duration 300 --rate 50 --engine async --json soak.json
+
+Runs the listener in a subprocess for a fixed duration, then stops producing comments and gives it a grace period to
+catch up. Reports sustained comments/sec, ping-to-queue latency percentiles, memory growth and leaked locks.
+
+With --profile DIR the listener is profiled from the end of the warmup until comments stop, and its report is written
+to DIR. Runs with the same seed, rate and duration produce comparable profiles across builds.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import boto3
+
+from soak.fake_reddit import CommentFactory, FakeRedditServer
+
+BUCKET = "tacostats-soak"
+QUEUE = "tacostats-pinger"
+REGION = "us-east-1"
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def main():
+    args = _parse_args()
+    moto_port = _free_port()
+    moto = subprocess.Popen(
+        [sys.executable, "-m", "moto.server", "-p", str(moto_port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    reddit = None
+    listener = None
+    try:
+        moto_url = f"http://127.0.0.1:{moto_port}"
+        _wait_for_port(moto_port)
+        s3 = _aws("s3", moto_url)
+        sqs = _aws("sqs", moto_url)
+        s3.create_bucket(Bucket=BUCKET)
+        queue_url = sqs.create_queue(QueueName=QUEUE)["QueueUrl"]
+
+        factory = CommentFactory(rate=args.rate, ping_ratio=args.ping_ratio, seed=args.seed)
+        reddit = FakeRedditServer(factory).start()
+
+        with open(args.log, "w") as log:
+            listener = subprocess.Popen(
+                [sys.executable, "-m", "tacostats_listener.listener"],
+                env=_listener_env(args, moto_url, queue_url, reddit.url),
+                cwd=ROOT,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+            )
+            rss = _run(listener, args, factory)
+
+        report = _report(args, factory, reddit, rss, s3, sqs, queue_url)
+        if args.profile:
+            report["profile"] = _profile(args.profile, listener.pid)
+        _print_report(report)
+        if args.json:
+            Path(args.json).write_text(json.dumps(report, indent=2))
+    finally:
+        for proc in [listener, moto]:
+            if proc and proc.poll() is None:
+                proc.terminate()
+                try:
+                    proc.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+        if reddit:
+            reddit.stop()
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(prog="python -m soak", description=__doc__.split("\n")[0])
+    parser.add_argument("--duration", type=float, default=60, help="seconds to produce comments for")
+    parser.add_argument("--grace", type=float, default=15, help="seconds to let the listener catch up afterwards")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds before the memory baseline is taken")
+    parser.add_argument("--rate", type=float, default=10, help="comments per second")
+    parser.add_argument("--ping-ratio", type=float, default=0.02, help="fraction of comments containing a command")
+    parser.add_argument("--engine", choices=["sync", "async"], default="sync")
+    parser.add_argument("--whitelist", action="store_true", help="leave the whitelist on, rejecting most pings")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log", default=os.devnull, help="file to write listener output to")
+    parser.add_argument("--json", help="file to write the report to")
+    parser.add_argument("--profile", metavar="DIR", help="profile the listener, writing its report to DIR")
+    parser.add_argument(
+        "--env", action="append", default=[], metavar="KEY=VALUE", help="extra env vars for the listener"
+    )
+    return parser.parse_args()
+
+
+def _listener_env(args, moto_url: str, queue_url: str, reddit_url: str) -> Dict[str, str]:
+    env = {
+        **os.environ,
+        "PYTHONUNBUFFERED": "1",
+        "AWS_ENDPOINT_URL": moto_url,
+        "AWS_DEFAULT_REGION": REGION,
+        "AWS_ACCESS_KEY_ID": "soak",
+        "AWS_SECRET_ACCESS_KEY": "soak",
+        "LOCKFILE_BUCKET": BUCKET,
+        "SQS_URL": queue_url,
+        "REDDIT_ID": "soak",
+        "REDDIT_SECRET": "soak",
+        "REDDIT_PASS": "soak",
+        "REDDIT_USER": "tacostats",
+        "REDDIT_UA": "tacostats soak harness",
+        "REDDIT_URL": reddit_url,
+        "praw_check_for_updates": "False",
+        "WHITELIST_ENABLED": str(args.whitelist),
+        "ASYNC_ENGINE": str(args.engine == "async"),
+    }
+    if args.profile:
+        env.update(
+            {
+                "PROFILE_START_AFTER": str(args.warmup),
+                "PROFILE_WINDOW": str(args.duration - args.warmup),
+                "PROFILE_DIR": str(Path(args.profile).resolve()),
+            }
+        )
+    env.update(i.split("=", 1) for i in args.env)
+    return env
+
+
+def _run(listener: subprocess.Popen, args, factory: CommentFactory) -> Dict[str, Any]:
+    """Lets the listener run, sampling its memory once a second."""
+    samples = []
+    baseline = None
+    started = time.monotonic()
+    stopped = None
+    while time.monotonic() - started < args.duration + args.grace:
+        if listener.poll() is not None:
+            raise RuntimeError(f"listener exited early with {listener.returncode}, see --log")
+        elapsed = time.monotonic() - started
+        if stopped is None and elapsed >= args.duration:
+            factory.stop()
+            stopped = {"generated": factory.generated, "delivered": factory.delivered}
+        rss = _rss(listener.pid)
+        if rss is not None:
+            samples.append(rss)
+            if baseline is None and elapsed >= args.warmup:
+                baseline = rss
+        time.sleep(1)
+
+    return {
+        "at_stop": stopped or {"generated": factory.generated, "delivered": factory.delivered},
+        "rss_baseline_kb": baseline,
+        "rss_end_kb": samples[-1] if samples else None,
+        "rss_peak_kb": max(samples) if samples else None,
+    }
+
+
+def _report(args, factory: CommentFactory, reddit: FakeRedditServer, run, s3, sqs, queue_url: str) -> Dict[str, Any]:
+    latencies = []
+    for message in _drain_queue(sqs, queue_url):
+        generated_at = factory.generated_at(json.loads(message["Body"])["requester_comment_id"])
+        if generated_at:
+            latencies.append(int(message["Attributes"]["SentTimestamp"]) / 1000 - generated_at)
+    latencies.sort()
+
+    at_stop = run["at_stop"]
+    baseline, end = run["rss_baseline_kb"], run["rss_end_kb"]
+    pings: Dict[str, int] = {}
+    for kind in factory.pings.values():
+        pings[kind] = pings.get(kind, 0) + 1
+    dms: Dict[str, int] = {}
+    for dm in reddit.dms:
+        dms[dm.get("subject", "")] = dms.get(dm.get("subject", ""), 0) + 1
+
+    return {
+        "engine": args.engine,
+        "duration": args.duration,
+        "target_rate": args.rate,
+        "comments_generated": at_stop["generated"],
+        "comments_delivered": at_stop["delivered"],
+        "sustained_comments_per_sec": round(at_stop["delivered"] / args.duration, 2),
+        "backlog_at_stop": at_stop["generated"] - at_stop["delivered"],
+        "backlog_after_grace": factory.generated - factory.delivered,
+        "pings_generated": pings,
+        "pings_queued": len(latencies),
+        "ping_to_queue_secs": {
+            "p50": _percentile(latencies, 50),
+            "p90": _percentile(latencies, 90),
+            "p99": _percentile(latencies, 99),
+            "max": round(latencies[-1], 3) if latencies else None,
+        },
+        "dms": dms,
+        "reddit_requests": reddit.requests,
+        "rss_baseline_kb": baseline,
+        "rss_end_kb": end,
+        "rss_peak_kb": run["rss_peak_kb"],
+        "rss_growth_kb": end - baseline if baseline is not None and end is not None else None,
+        "leaked_locks": _locked_keys(s3),
+    }
+
+
+def _profile(profile_dir: str, pid: int, timeout: float = 30) -> Dict[str, Any]:
+    """Waits for the listener's profile and summarizes its stages."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        # the json is written last, once the collapsed stacks are already there
+        reports = sorted(Path(profile_dir).glob(f"tacostats-profile-{pid}-*.json"))
+        if reports:
+            profile = json.loads(reports[-1].read_text())
+            stages = {name: stage["mean_ms"] for name, stage in profile["stages"].items()}
+            return {"path": str(reports[-1]), "samples": profile["samples"], "stage_mean_ms": stages}
+        time.sleep(0.5)
+    raise RuntimeError(f"listener didn't write a profile to {profile_dir}, see --log")
+
+
+def _print_report(report: Dict[str, Any]):
+    width = max(len(k) for k in report)
+    for key, value in report.items():
+        print(f"{key.ljust(width)}  {value}")
+
+
+def _drain_queue(sqs, queue_url: str) -> List[Dict[str, Any]]:
+    messages = []
+    while True:
+        batch = sqs.receive_message(
+            QueueUrl=queue_url, MaxNumberOfMessages=10, VisibilityTimeout=600, AttributeNames=["SentTimestamp"]
+        ).get("Messages", [])
+        if not batch:
+            return messages
+        messages.extend(batch)
+
+
+def _locked_keys(s3) -> List[str]:
+    locked = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=BUCKET):
+        for obj in page.get("Contents", []):
+            tags = s3.get_object_tagging(Bucket=BUCKET, Key=obj["Key"])["TagSet"]
+            if any(t["Key"] == "Locked" for t in tags):
+                locked.append(obj["Key"])
+    return locked
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, max(0, round(pct / 100 * len(values)) - 1))], 3)
+
+
+def _rss(pid: int) -> Optional[int]:
+    """Resident memory of a process in kB, linux only."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _aws(service: str, endpoint_url: str):
+    return boto3.client(
+        service,
+        endpoint_url=endpoint_url,
+        region_name=REGION,
+        aws_access_key_id="soak",
+        aws_secret_access_key="soak",
+    )
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"moto server didn't come up on port {port}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+import json
+import random
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+# Just enough of the Reddit API for praw and asyncpraw to stream comments, load submissions and parents, and send DMs.
+# Point the listener at it with the REDDIT_URL env var.
+
+SUBMISSIONS = {
+    "dt": {"title": "Discussion Thread", "author": "jobautomator"},
+    "news": {"title": "Some news article", "author": "newsposter"},
+}
+
+LOREM = [
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit.",
+    "Aenean eget nibh varius, accumsan arcu id, malesuada lacus.",
+    "Nulla vehicula metus id nulla posuere dapibus.",
+    "Etiam rhoncus magna non aliquet maximus.",
+    "Curabitur et felis tincidunt, malesuada felis sed, fringilla orci.",
+    "Ut ac arcu nec diam ultricies faucibus pretium a orci.",
+]
+
+SPANS = ["", " daily", " weekly", " monthly", " all"]
+
+# keeps ids a realistic length
+ID_OFFSET = 1000000
+
+# relative weights of each kind of command, see `CommentFactory._command`
+PING_MIX = {
+    "mystats": 45,
+    "stats_parent": 35,
+    "stats_dt": 5,
+    "optout": 10,
+    "ban": 1,
+    "bot_parent": 4,
+}
+
+
+class CommentFactory:
+    """Produces comments at a fixed rate with a realistic mix of chatter, pings, opt-outs and bans.
+
+    Args:
+        rate - comments per second.
+        ping_ratio - fraction of comments which contain a command.
+        dt_ratio - fraction of comments posted in the DT rather than another submission.
+        users - size of the commenter pool.
+        keep - number of recent comments kept around for parents, info lookups, listings and threads.
+        seed - random seed, so runs are repeatable.
+    """
+
+    def __init__(
+        self,
+        rate: float = 10,
+        ping_ratio: float = 0.02,
+        dt_ratio: float = 0.9,
+        users: int = 2000,
+        keep: int = 10000,
+        seed: int = 0,
+    ):
+        self.rate = rate
+        self.ping_ratio = ping_ratio
+        self.dt_ratio = dt_ratio
+        self.users = [f"user{i}" for i in range(users)] + ["tacostats", "inhumantsar"]
+        self.keep = keep
+        self.random = random.Random(seed)
+        self.comments: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.generated = 0
+        self.delivered = 0
+        self.pings: Dict[str, str] = {}
+        self.producing = True
+        self._started = time.time()
+        self._lock = threading.Lock()
+
+    def stop(self):
+        """Stop producing new comments."""
+        with self._lock:
+            self._catch_up()
+            self.producing = False
+
+    def listing(self, limit: int, before: Optional[str]) -> List[Dict[str, Any]]:
+        """Returns up to `limit` comments newer than `before`, newest first, like /r/sub/comments."""
+        with self._lock:
+            self._catch_up()
+            # ids are sequential, so the page can be worked out without scanning
+            newest = self.generated
+            if before and before[3:] in self.comments:
+                first = _seq(before[3:]) + 1
+                last = min(newest, first + limit - 1)
+            else:
+                last = newest
+                first = max(newest - limit + 1, newest - len(self.comments) + 1)
+            children = []
+            for seq in range(last, first - 1, -1):
+                comment = self.comments[_base36(seq + ID_OFFSET)]
+                if "delivered_at" not in comment:
+                    comment["delivered_at"] = time.time()
+                    self.delivered += 1
+                children.append(_thing("t1", comment["data"]))
+            return children
+
+    def info(self, fullnames: List[str]) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [_thing("t1", self.comments[i[3:]]["data"]) for i in fullnames if i[3:] in self.comments]
+
+    def thread(self, submission: str, limit: int) -> List[Dict[str, Any]]:
+        """The submission's most recent comments, flattened, as its comment listing. Nothing is marked delivered."""
+        with self._lock:
+            comments = (i["data"] for i in reversed(self.comments.values()))
+            return [_thing("t1", i) for i in comments if i["link_id"] == f"t3_{submission}"][:limit]
+
+    def generated_at(self, comment_id: str) -> Optional[float]:
+        with self._lock:
+            comment = self.comments.get(comment_id)
+            return comment["generated_at"] if comment else None
+
+    def _catch_up(self):
+        """Generates however many comments should exist by now."""
+        if not self.producing:
+            return
+        due = int((time.time() - self._started) * self.rate)
+        while self.generated < due:
+            self._generate()
+
+    def _generate(self):
+        submission = "dt" if self.random.random() < self.dt_ratio else "news"
+        author = self.random.choice(self.users)
+        body = " ".join(self.random.sample(LOREM, self.random.randint(1, 3)))
+        # chatter replies to something recent about half the time
+        parent = self._recent_parent(submission) if self.random.random() < 0.5 else None
+
+        if self.random.random() < self.ping_ratio:
+            kind = self.random.choices(list(PING_MIX.keys()), weights=list(PING_MIX.values()))[0]
+            if kind == "bot_parent":
+                parent = self._add(submission, "AutoModerator", body, None)
+            id = self._add(*self._command(kind, submission, author, body, parent))
+            self.pings[id] = kind
+        else:
+            self._add(submission, author, body, parent)
+
+    def _command(self, kind: str, submission: str, author: str, body: str, parent: Optional[str]):
+        span = self.random.choice(SPANS)
+        if kind == "mystats":
+            return submission, author, f"{body} !mystats{span}", parent
+        if kind in ("stats_parent", "bot_parent"):
+            return submission, author, f"{body} !stats{span}", parent or self._recent_parent(submission)
+        if kind == "stats_dt":
+            return submission, author, f"!stats{span} {body}", None
+        if kind == "optout":
+            return submission, author, "!statsoptout", parent
+        return submission, "inhumantsar", f"!ban {body}", parent or self._recent_parent(submission)
+
+    def _add(self, submission: str, author: str, body: str, parent: Optional[str]) -> str:
+        self.generated += 1
+        id = _base36(self.generated + ID_OFFSET)
+        # comments are generated lazily when requested, so timestamp them when they were due rather than now
+        now = self._started + self.generated / self.rate
+        self.comments[id] = {
+            "generated_at": now,
+            "data": {
+                "id": id,
+                "name": f"t1_{id}",
+                "body": body,
+                "author": author,
+                "link_id": f"t3_{submission}",
+                "parent_id": f"t1_{parent}" if parent else f"t3_{submission}",
+                "created_utc": float(int(now)),
+                "subreddit": "neoliberal",
+                "score": 1,
+                "replies": "",
+            },
+        }
+        while len(self.comments) > self.keep:
+            self.comments.popitem(last=False)
+        return id
+
+    def _recent_parent(self, submission: str) -> Optional[str]:
+        """Picks the most recent chatter in the submission to reply to."""
+        for seq in range(self.generated, max(self.generated - 50, 0), -1):
+            comment = self.comments.get(_base36(seq + ID_OFFSET))
+            if comment and comment["data"]["link_id"] == f"t3_{submission}" and "!" not in comment["data"]["body"]:
+                return comment["data"]["id"]
+        return None
+
+
+class FakeRedditServer:
+    """Serves a `CommentFactory` over http on a background thread."""
+
+    def __init__(self, factory: CommentFactory, host: str = "127.0.0.1", port: int = 0):
+        self.factory = factory
+        self.dms: List[Dict[str, str]] = []
+        self.requests: Dict[str, int] = {}
+        self.httpd = _Server((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self  # type: ignore
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeRedditServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # clients hanging up mid-request is expected when the listener is stopped
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path.strip("/")
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self._count(path)
+        factory = self.server.fake.factory  # type: ignore
+
+        if path.startswith("r/") and path.endswith("/comments"):
+            children = factory.listing(int(params.get("limit", 100)), params.get("before"))
+            return self._json(_listing(children))
+
+        if path == "api/info":
+            return self._json(_listing(factory.info(params.get("id", "").split(","))))
+
+        if path.startswith("comments/"):
+            id = path.split("/")[1]
+            submission = SUBMISSIONS.get(id)
+            if not submission:
+                return self._json({"message": "Not Found", "error": 404}, 404)
+            data = {"id": id, "name": f"t3_{id}", "subreddit": "neoliberal", "created_utc": 0.0, **submission}
+            # praw asks for up to 2048 comments along with the submission, send back as many as the factory has kept
+            comments = factory.thread(id, int(params.get("limit", 2048)))
+            return self._json([_listing([_thing("t3", data)]), _listing(comments)])
+
+        self._json({"message": "Not Found", "error": 404}, 404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        path = url.path.strip("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        form = {k: v[-1] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+        self._count(path)
+
+        if path == "api/v1/access_token":
+            return self._json({"access_token": "soak", "expires_in": 86400, "scope": "*", "token_type": "bearer"})
+
+        if path == "api/compose":
+            self.server.fake.dms.append(form)  # type: ignore
+            return self._json({"json": {"errors": []}})
+
+        self._json({"message": "Not Found", "error": 404}, 404)
+
+    def _count(self, path: str):
+        key = "listing" if path.startswith("r/") else "submission" if path.startswith("comments/") else path
+        requests = self.server.fake.requests  # type: ignore
+        requests[key] = requests.get(key, 0) + 1
+
+    def _json(self, body: Any, status: int = 200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _thing(kind: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    return {"kind": kind, "data": data}
+
+
+def _listing(children: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {"kind": "Listing", "data": {"children": children, "after": None, "before": None, "dist": len(children)}}
+
+
+def _seq(id: str) -> int:
+    return int(id, 36) - ID_OFFSET
+
+
+def _base36(n: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    out = ""
+    while n:
+        n, r = divmod(n, 36)
+        out = digits[r] + out
+    return out
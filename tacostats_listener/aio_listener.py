@@ -0,0 +1,365 @@
+import asyncio
+import json
+import logging
+
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Set, Tuple, Union
+
+from tacostats_listener import aio_s3, logs, profiling
+from tacostats_listener.config import (
+    AWS_ENDPOINT_URL,
+    EXCLUDED_AUTHORS,
+    MAX_CONCURRENT_AWS,
+    MAX_CONCURRENT_PINGS,
+    REDDIT,
+    SQS_URL,
+)
+from tacostats_listener.listener import (
+    OPTOUT_ATTEMPTS,
+    PING_REGEX,
+    InvalidTargetError,
+    RejectedPingError,
+    _apply_history_update,
+    _can_ping,
+    _classify,
+    _get_requested_days,
+    _has_command,
+    _is_dt,
+    _lag,
+    _optout_retry_delay,
+)
+from tacostats_listener.logs import event
+from tacostats_listener.shedding import LoadShedder, Priority
+from tacostats_listener.supervisor import StreamSupervisor
+
+log = logging.getLogger(__name__)
+
+# how many submissions to remember DT checks for. there's only one DT a day, this just stops the cache growing forever.
+DT_CACHE_SIZE = 1000
+
+
+async def listen():
+    """Listen to incoming comments using asyncpraw and aiobotocore."""
+    import asyncpraw
+    from aiobotocore.session import get_session
+
+    session = get_session()
+    async with asyncpraw.Reddit(**REDDIT) as reddit, session.create_client(
+        "s3", endpoint_url=AWS_ENDPOINT_URL
+    ) as s3_client, session.create_client("sqs", endpoint_url=AWS_ENDPOINT_URL) as sqs_client:
+        await AsyncListener(reddit, s3_client, sqs_client).listen()
+
+
+class AsyncListener:
+    """asyncio engine for the listener.
+
+    Mirrors `listener.listen` but handles independent pings concurrently. Pings from the same author are handled one
+    at a time so the s3 lock is never contended within this process. Comments are queued by priority class, so when
+    the listener falls behind admin commands and opt-outs jump ahead of pings, and error-dm-only work gets shed.
+
+    The stream is never paused, a reader which stopped polling would miss comments once more than a listing page
+    arrived in between. Comments with a command queue up in memory instead until a slot frees up.
+
+    Args:
+        reddit - asyncpraw Reddit client, or anything quacking like one.
+        s3_client - aiobotocore s3 client.
+        sqs_client - aiobotocore sqs client.
+        max_pings - number of comments which can be handled at once, the rest wait in the queue.
+        max_aws - number of s3/sqs calls which can be in flight at once.
+        shedder - decides what to drop under load, defaults to a fresh `LoadShedder`.
+        supervisor - reconnects the comment stream on stalls and errors, defaults to a fresh `StreamSupervisor`.
+    """
+
+    def __init__(
+        self,
+        reddit,
+        s3_client,
+        sqs_client,
+        max_pings: int = MAX_CONCURRENT_PINGS,
+        max_aws: int = MAX_CONCURRENT_AWS,
+        shedder: LoadShedder = None,
+        supervisor: StreamSupervisor = None,
+    ):
+        self.reddit = reddit
+        self.s3_client = s3_client
+        self.sqs_client = sqs_client
+        self.max_pings = max_pings
+        self.max_aws = max_aws
+        # made in `listen`, asyncio primitives bind to the loop they're created under on python 3.9
+        self._ping_slots: asyncio.Semaphore = None  # type: ignore
+        self._aws_slots: asyncio.Semaphore = None  # type: ignore
+        self._queue: asyncio.PriorityQueue = None  # type: ignore
+        self._tasks: Set[asyncio.Task] = set()
+        self._user_locks: Dict[str, asyncio.Lock] = {}
+        self._user_waiters: Dict[str, int] = {}
+        self._dt_cache: Dict[str, asyncio.Task] = {}
+        self._queued = 0
+        self.shedder = shedder or LoadShedder()
+        self.supervisor = supervisor or StreamSupervisor()
+
+    async def listen(self, subreddit: str = "neoliberal"):
+        """Listen to incoming comments and wait for ping command"""
+        self._ping_slots = asyncio.Semaphore(self.max_pings)
+        self._aws_slots = asyncio.Semaphore(self.max_aws)
+        self._queue = asyncio.PriorityQueue()
+        sub = await self.reddit.subreddit(subreddit)
+        stream = lambda skip_existing: sub.stream.comments(skip_existing=skip_existing, pause_after=0)
+        dispatcher = asyncio.create_task(self._dispatch_queued())
+        try:
+            async for comment in self.supervisor.acomments(stream):
+                log.debug("comment received", extra=event("comment", comment_id=comment.id))
+                self.dispatch(comment)
+        finally:
+            await self.drain()
+            dispatcher.cancel()
+
+    def dispatch(self, comment):
+        """Queue a comment for handling according to its priority class."""
+        # skip comments from deleted or excluded authors
+        if not comment.author or comment.author.name in EXCLUDED_AUTHORS:
+            return
+
+        # skip comments without a command before doing any io
+        if not _has_command(comment):
+            return
+
+        # the counter keeps the queue fifo within a priority class
+        self._queued += 1
+        self._queue.put_nowait((_classify(comment), self._queued, comment))
+
+    async def drain(self):
+        """Wait for queued and in-flight comments to finish."""
+        await self._queue.join()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _dispatch_queued(self):
+        """Hands queued comments to tasks, highest priority first, waiting for a free slot if too many are in flight.
+        Only this waits, the stream keeps being read and dispatched into the queue meanwhile."""
+        while True:
+            priority, _, comment = await self._queue.get()
+            try:
+                # drop low priority work if we've fallen behind
+                if not self.shedder.admit(priority, _lag(comment), self._queue.qsize()):
+                    continue
+                await self._ping_slots.acquire()
+                task = asyncio.create_task(self._handle_comment(comment, priority))
+                self._tasks.add(task)
+                task.add_done_callback(self._task_done)
+            finally:
+                self._queue.task_done()
+
+    def _task_done(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        self._ping_slots.release()
+        if not task.cancelled() and task.exception():
+            log.error(
+                "unhandled error while handling comment",
+                exc_info=task.exception(),
+                extra=event("comment_error", error=repr(task.exception())),
+            )
+
+    async def _handle_comment(self, comment, priority: Priority):
+        # each task has its own context, so this only tags this comment's logs
+        logs.correlation_id.set(comment.id)
+
+        # skip invalid comments
+        if not await self._is_dt(comment.submission):
+            return
+
+        author = comment.author.name
+        body = comment.body
+
+        # admin commands
+        if priority == Priority.ADMIN:
+            await self._ban(comment)
+            return
+
+        if priority == Priority.OPTOUT:
+            await self._retry_optout(author)
+            return
+
+        await self._handle_ping(comment)
+
+    @profiling.timed("ping")
+    async def _handle_ping(self, comment):
+        author = comment.author.name
+        params = None
+        try:
+            params = await self._parse_ping(comment)
+        except Exception as e:
+            await self._send_error_dm(comment, e)
+
+        if params:
+            log.info("found a ping", extra=event("ping_found", **params))
+            async with self._user_lock(author):
+                await self._s3(aio_s3.lock, author)
+                try:
+                    history = await self._get_history(author)
+                    if _can_ping(history):
+                        log.info("posting to queue", extra=event("ping_queued", **params))
+                        async with self._aws_slots:
+                            with profiling.stage("ping.sqs_send"):
+                                await self.sqs_client.send_message(QueueUrl=SQS_URL, MessageBody=json.dumps(params))
+                    await self._update_history(history, params)
+                except Exception as e:
+                    await self._send_error_dm(comment, e)
+                finally:
+                    await self._s3(aio_s3.unlock, author)
+
+    async def _send_error_dm(self, comment, e: Exception):
+        """Logs a ping error and DMs it to the requester, unless the ping is too stale to bother."""
+        if not isinstance(e, InvalidTargetError) and not isinstance(e, RejectedPingError):
+            log.exception("unexpected error handling ping", extra=event("ping_error", error=repr(e)))
+        if not self.shedder.allow_error_dm(_lag(comment)):
+            log.info("skipping error dm for stale ping", extra=event("error_dm_skipped", error=str(e)))
+            return
+        log.info("sending error dm", extra=event("error_dm_sent", error=str(e)))
+        await self._send_dm(comment.author.name, str(e), subject="tacostats ping error")
+
+    async def _send_dm(self, username: str, message: str, subject: str = "Your latest tacostats ping."):
+        """Sends a private message to a Redditor."""
+        redditor = await self.reddit.redditor(username)
+        await redditor.message(subject, message)
+
+    async def _ban(self, comment):
+        _, username = await self._get_requested_targets("ban", comment)
+        reason = comment.body.replace("!ban", "")
+        async with self._user_lock(username):
+            await self._update_history(await self._get_history(username), ban=True)
+        msg = f"""You have been banned from using the tacostats pings.
+
+    Reason: {reason}
+
+    You will not be able to request stats for yourself or others.
+
+    Other redditors will be able to request stats on you and your comments will still be collected for the daily leaderboard.
+    """
+        await self._send_dm(username, msg, "Banned by tacostats")
+        log.info("user banned", extra=event("banned", username=username))
+
+    async def _retry_optout(self, username: str):
+        for attempt in range(OPTOUT_ATTEMPTS):
+            try:
+                # optouts don't require locking in s3, but they still shouldn't race pings from the same author
+                async with self._user_lock(username):
+                    await self._optout(username)
+                return
+            except Exception as e:
+                await asyncio.sleep(_optout_retry_delay(username, attempt, e))
+
+    async def _optout(self, username: str):
+        msg = """"You have successfully opted-out from tacostats pings.
+
+    Other users will not be able to request your personal stats, and I will ignore all pings from your account.
+
+    Your DT comments will still be collected as a part of the aggregate daily stats collection and your username will be included in the leaderboards if you qualify.
+    """
+        await self._update_history(await self._get_history(username), optout=True)
+        await self._send_dm(username, msg, "tacostats opt-out")
+        log.info("user opted out", extra=event("opted_out", username=username))
+
+    @profiling.timed("ping.get_history")
+    async def _get_history(self, username: str) -> Dict[str, Any]:
+        try:
+            history = await self._s3(aio_s3.read, username)
+            # treat blank dicts like not found errors, this can happen if a lock is created before the history
+            if not history:
+                raise KeyError()
+            return history
+        except KeyError:
+            return {"username": username}
+
+    @profiling.timed("ping.update_history")
+    async def _update_history(
+        self, history: Dict[str, Any], params: Dict[str, Any] = None, ban: bool = False, optout: bool = False
+    ) -> Dict[str, Any]:
+        """Updates user history with new info"""
+        log.info("updating history", extra=event("history_updating", username=history["username"]))
+        history = _apply_history_update(history, params, ban, optout)
+        update = {history["username"]: history}
+        await self._s3(aio_s3.write, **update)
+        log.info("history updated", extra=event("history_updated", username=history["username"]))
+        return history
+
+    @profiling.timed("ping.parse")
+    async def _parse_ping(self, comment) -> Union[None, Dict[str, Union[str, int]]]:
+        """Looks for ping phrases and returns the appropriate parameters"""
+        with profiling.stage("ping.regex"):
+            match = PING_REGEX.search(comment.body)
+        if match:
+            ping, span = match.groups()
+            target_id, target_user = await self._get_requested_targets(ping, comment)
+            days = _get_requested_days(span)
+            return {
+                "comment_id": target_id,
+                "username": target_user,
+                "days": days,
+                "requester": comment.author.name,
+                "requester_comment_id": comment.id,
+            }
+
+    async def _get_requested_targets(self, ping: str, comment) -> Tuple[str, str]:
+        """Determines whether requester meant to target self or the parent comment.
+
+        Returns (comment_id, comment_author)
+        """
+        if ping.startswith("my") and comment.author and comment.author.name:
+            return (comment.id, comment.author.name)
+        else:
+            # t3_ is the submission prefix. checked before any io, there's nothing to load for a ping against the DT.
+            if comment.parent_id.startswith("t3_"):
+                raise InvalidTargetError("Ping rejected. Attempted to request stats against the DT.")
+            # fetch the parent by id rather than through `comment.parent()`, which first downloads the whole DT along
+            # with its comments whenever the comment's submission isn't loaded, and streamed comments' never are.
+            with profiling.stage("praw.load_parent"):
+                parent = await self.reddit.comment(comment.parent_id[3:])
+            if parent.author.name in EXCLUDED_AUTHORS:
+                raise InvalidTargetError(f"Ping rejected. {parent.author.name} is an excluded author.")
+            if (await self._get_history(parent.author.name)).get("excluded", None):
+                raise InvalidTargetError(
+                    f"Ping rejected. {parent.author.name} you attempted to get stats for has opted out."
+                )
+            return (parent.id, parent.author.name)
+
+    async def _is_dt(self, submission) -> bool:
+        """Checks whether a submission is a DT, loading it at most once.
+
+        The load is cached as a task, so comments arriving while it's in flight wait on it rather than loading again.
+        """
+        check = self._dt_cache.get(submission.id)
+        if check is None:
+            if len(self._dt_cache) >= DT_CACHE_SIZE:
+                self._dt_cache.clear()
+            check = self._dt_cache[submission.id] = asyncio.create_task(self._load_dt(submission))
+        # one waiter being cancelled shouldn't cancel the load for the rest
+        return await asyncio.shield(check)
+
+    async def _load_dt(self, submission) -> bool:
+        try:
+            with profiling.stage("praw.load_submission"):
+                await submission.load()
+        except Exception:
+            # let the next comment try again
+            self._dt_cache.pop(submission.id, None)
+            raise
+        return _is_dt(submission)
+
+    async def _s3(self, func, *args, **kwargs):
+        """Runs an aio_s3 function once an aws slot is free."""
+        async with self._aws_slots:
+            return await func(self.s3_client, *args, **kwargs)
+
+    @asynccontextmanager
+    async def _user_lock(self, username: str):
+        """Serializes work on a single user's history, dropping the lock once nobody is waiting on it."""
+        lock = self._user_locks.setdefault(username, asyncio.Lock())
+        self._user_waiters[username] = self._user_waiters.get(username, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._user_waiters[username] -= 1
+            if not self._user_waiters[username]:
+                del self._user_waiters[username]
+                del self._user_locks[username]
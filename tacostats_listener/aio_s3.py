@@ -0,0 +1,121 @@
+import json
+
+from typing import Any, Dict
+
+from botocore.exceptions import ClientError
+
+from tacostats_listener import profiling, util
+from tacostats_listener.config import LOCKFILE_BUCKET
+from tacostats_listener.s3 import LOCK_TAG_KEY, AlreadyLocked, LockError, _from_tag_set, _to_tag_set
+
+# asyncio counterparts to the functions in s3. these take an aiobotocore s3 client rather than creating their own.
+
+
+@profiling.timed("s3.unlock")
+async def unlock(client, key: str):
+    """Remove lock tag from s3 object"""
+    tags = {}
+
+    # get existing tags
+    try:
+        tags = await _read_tags(client, key)
+    except ClientError as e:
+        # no obj is not a big deal
+        if e.response["Error"]["Code"] != "NoSuchKey":
+            raise LockError(e)
+
+    # toss the lock if it exists
+    _ = tags.pop(LOCK_TAG_KEY, None)
+
+    # write tags
+    try:
+        return await _write_tags(client, key, tags)
+    except ClientError as e:
+        raise LockError(e)
+
+
+@profiling.timed("s3.lock")
+async def lock(client, key: str) -> Dict[str, str]:
+    """Add lock tag to s3 object creating an empty one if necessary.
+
+    Exceptions:
+        Raises `AlreadyLocked` if the file is already locked.
+        Raises `LockError` if unable to lock the obj.
+    """
+    tags = {}
+    now = util.now()
+
+    # fetch existing tags
+    try:
+        tags = await _read_tags(client, key)
+    except ClientError as e:
+        # no obj is not a big deal
+        if e.response["Error"]["Code"] == "NoSuchKey":
+            await client.put_object(
+                Bucket=LOCKFILE_BUCKET, Body="{}", Key=f"{key}.json", Tagging=f"{LOCK_TAG_KEY}={now}"
+            )
+            return {LOCK_TAG_KEY: f"{now}"}
+        else:
+            raise LockError(e)
+
+    # if there's a lock which is <10mins old, throw AlreadyLocked
+    if LOCK_TAG_KEY in tags.keys():
+        if int(tags[LOCK_TAG_KEY]) > now - 600:
+            raise AlreadyLocked()
+
+    # write tags
+    try:
+        return await _write_tags(client, key, {**tags, LOCK_TAG_KEY: now})
+    except ClientError as e:
+        raise LockError(e)
+
+
+async def _read_tags(client, key: str) -> Dict[str, str]:
+    response = await client.get_object_tagging(Bucket=LOCKFILE_BUCKET, Key=f"{key}.json")
+    return _from_tag_set(response["TagSet"])
+
+
+async def _write_tags(client, key: str, tags: Dict) -> Dict[str, str]:
+    tag_set = _to_tag_set(tags)
+
+    # boto freaks out if you try put_object_tagging with an empty dict
+    try:
+        if tag_set:
+            await client.put_object_tagging(Bucket=LOCKFILE_BUCKET, Key=f"{key}.json", Tagging={"TagSet": tag_set})
+        else:
+            await client.delete_object_tagging(Bucket=LOCKFILE_BUCKET, Key=f"{key}.json")
+    except ClientError as e:
+        # no obj is not a big deal
+        if e.response["Error"]["Code"] != "NoSuchKey":
+            raise LockError(e)
+
+    return _from_tag_set(tag_set)
+
+
+@profiling.timed("s3.write")
+async def write(client, /, **kwargs):
+    """write data to s3.
+
+    Args:
+        client - aiobotocore s3 client.
+        kwargs - key is s3 "filename" to write, value is json-serializable data.
+    """
+    for key, value in kwargs.items():
+        with profiling.stage("s3.json_dumps"):
+            body = str(json.dumps(value))
+        await client.put_object(Body=body, Bucket=LOCKFILE_BUCKET, Key=f"{key}.json")
+
+
+@profiling.timed("s3.read")
+async def read(client, key: str) -> Dict[str, Any]:
+    """Read json data stored in bucket."""
+    try:
+        object = await client.get_object(Bucket=LOCKFILE_BUCKET, Key=f"{key}.json")
+        json_str = (await object["Body"].read()).decode()
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchKey":
+            raise
+        raise KeyError(e)
+
+    with profiling.stage("s3.json_loads"):
+        return json.loads(json_str)
@@ -1,52 +1,97 @@
-import os
-
-from distutils.util import strtobool
-
-import boto3
-
-from dotenv import load_dotenv
-
-load_dotenv(verbose=True)
-
-VERSION = "v0.2.2"
-
-# don't write to sqs
-DRY_RUN = bool(strtobool(os.getenv("DRY_RUN", "False")))
-print("DRY_RUN set to", DRY_RUN)
-
-SQS_URL = os.getenv("SQS_URL")
-print("SQS_URL set to", SQS_URL)
-
-LOCKFILE_BUCKET = os.getenv("LOCKFILE_BUCKET")
-print("LOCKFILE_BUCKET set to", LOCKFILE_BUCKET)
-
-_WHITELIST_USERS = "inhumantsar,tacostats"
-WHITELIST_ENABLED = bool(strtobool(os.getenv("WHITELIST_ENABLED", "True")))
-WHITELIST = os.getenv("WHITELIST", _WHITELIST_USERS).split(",")
-print("WHITELIST set to ", WHITELIST)
-
-DEFAULT_HISTORY_DAYS = int(os.getenv("DEFAULT_HISTORY_DAYS", 7))
-
-secrets = boto3.client("secretsmanager")
-get_secret = lambda x: secrets.get_secret_value(SecretId=x)["SecretString"]
-
-REDDIT = {
-    "client_id": os.getenv("REDDIT_ID", get_secret("tacostats-reddit-client-id")),
-    "client_secret": os.getenv("REDDIT_SECRET", get_secret("tacostats-reddit-client-secret")),
-    "user_agent": os.getenv("REDDIT_UA"),
-    "username": os.getenv("REDDIT_USER"),
-    "password": os.getenv("REDDIT_PASS", get_secret("tacostats-reddit-password")),
-}
-
-TRIGGERS = [
-    "!stats",
-    "!monthlystats",
-    "!weeklystats",
-    "!dailystats",
-    "!mystats",
-    "!mymonthlystats",
-    "!myweeklystats",
-    "!mydailystats",
-]
-
-EXCLUDED_AUTHORS = ["jobautomator", "AutoModerator", "EmojifierBot", "groupbot", "ShiversifyBot"]
+import os
+
+from distutils.util import strtobool
+
+import boto3
+
+from dotenv import load_dotenv
+
+load_dotenv(verbose=True)
+
+VERSION = "v0.2.2"
+
+# don't write to sqs
+DRY_RUN = bool(strtobool(os.getenv("DRY_RUN", "False")))
+
+SQS_URL = os.getenv("SQS_URL")
+
+LOCKFILE_BUCKET = os.getenv("LOCKFILE_BUCKET")
+
+_WHITELIST_USERS = "inhumantsar,tacostats"
+WHITELIST_ENABLED = bool(strtobool(os.getenv("WHITELIST_ENABLED", "True")))
+WHITELIST = os.getenv("WHITELIST", _WHITELIST_USERS).split(",")
+
+DEFAULT_HISTORY_DAYS = int(os.getenv("DEFAULT_HISTORY_DAYS", 7))
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# keep 1 in n of these high volume log events, as event=n pairs
+LOG_SAMPLE = {k: int(v) for k, v in (i.split("=") for i in os.getenv("LOG_SAMPLE", "comment=100").split(",") if i)}
+
+# point aws clients somewhere other than aws, eg: a moto server for the soak harness
+AWS_ENDPOINT_URL = os.getenv("AWS_ENDPOINT_URL")
+
+# use the asyncio engine, requires asyncpraw and aiobotocore
+ASYNC_ENGINE = bool(strtobool(os.getenv("ASYNC_ENGINE", "False")))
+
+# asyncio engine limits: pings handled at once, and aws calls in flight across all of them
+MAX_CONCURRENT_PINGS = int(os.getenv("MAX_CONCURRENT_PINGS", 64))
+MAX_CONCURRENT_AWS = int(os.getenv("MAX_CONCURRENT_AWS", 16))
+
+# load shedding: skip error dms for pings older than this many seconds
+SHED_ERROR_DM_LAG = int(os.getenv("SHED_ERROR_DM_LAG", 120))
+# load shedding: skip error-dm-only comments outright when more than this many comments are queued. asyncio engine
+# only, the blocking engine handles comments as they arrive and never queues them.
+SHED_BACKLOG = int(os.getenv("SHED_BACKLOG", 256))
+# how often to log backlog, lag and shedding counts, in seconds
+SHED_REPORT_INTERVAL = int(os.getenv("SHED_REPORT_INTERVAL", 300))
+
+# stream watchdog: reconnect if no comments arrive for this many seconds during active hours
+STALL_TIMEOUT = int(os.getenv("STALL_TIMEOUT", 300))
+# utc hours when the DT is busy enough that a quiet stream means a stall, as start-end. wraps past midnight.
+STALL_ACTIVE_HOURS = tuple(int(i) for i in os.getenv("STALL_ACTIVE_HOURS", "11-6").split("-"))
+# stream watchdog: reconnect backoff bounds in seconds, doubled on each failed attempt and jittered
+RECONNECT_BASE_DELAY = float(os.getenv("RECONNECT_BASE_DELAY", 1))
+RECONNECT_MAX_DELAY = float(os.getenv("RECONNECT_MAX_DELAY", 60))
+# stream watchdog: delay bounds in seconds between polls which turn up no new comments, doubled on each empty poll
+POLL_BASE_DELAY = float(os.getenv("POLL_BASE_DELAY", 1))
+POLL_MAX_DELAY = float(os.getenv("POLL_MAX_DELAY", 16))
+
+# profiling: open a window this many seconds after startup as well as on SIGUSR1
+PROFILE_START_AFTER = float(os.environ["PROFILE_START_AFTER"]) if os.getenv("PROFILE_START_AFTER") else None
+# profiling: window length and stack sampling interval in seconds
+PROFILE_WINDOW = float(os.getenv("PROFILE_WINDOW", 60))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.005))
+# profiling: diff tracemalloc snapshots too. slows everything down while the window is open.
+PROFILE_TRACEMALLOC = bool(strtobool(os.getenv("PROFILE_TRACEMALLOC", "True")))
+# profiling: where reports are written, defaults to the temp dir
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+
+secrets = boto3.client("secretsmanager", endpoint_url=AWS_ENDPOINT_URL)
+get_secret = lambda x: secrets.get_secret_value(SecretId=x)["SecretString"]
+# only hit secrets manager when the env var isn't set
+get_env_or_secret = lambda env, x: os.getenv(env) or get_secret(x)
+
+REDDIT = {
+    "client_id": get_env_or_secret("REDDIT_ID", "tacostats-reddit-client-id"),
+    "client_secret": get_env_or_secret("REDDIT_SECRET", "tacostats-reddit-client-secret"),
+    "user_agent": os.getenv("REDDIT_UA"),
+    "username": os.getenv("REDDIT_USER"),
+    "password": get_env_or_secret("REDDIT_PASS", "tacostats-reddit-password"),
+}
+
+# point praw somewhere other than reddit, eg: the soak harness' fake reddit
+if os.getenv("REDDIT_URL"):
+    REDDIT["oauth_url"] = REDDIT["reddit_url"] = os.getenv("REDDIT_URL")
+
+TRIGGERS = [
+    "!stats",
+    "!monthlystats",
+    "!weeklystats",
+    "!dailystats",
+    "!mystats",
+    "!mymonthlystats",
+    "!myweeklystats",
+    "!mydailystats",
+]
+
+EXCLUDED_AUTHORS = ["jobautomator", "AutoModerator", "EmojifierBot", "groupbot", "ShiversifyBot"]
@@ -0,0 +1,139 @@
+import atexit
+import itertools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional
+
+from tacostats_listener.config import LOG_LEVEL, LOG_SAMPLE
+
+# Structured logging. Calls pass a constant message plus an `event(...)` as `extra`, eg:
+#
+#     log.info("found a ping", extra=event("ping_found", **params))
+#
+# Records are handed to a queue as-is and formatted as json lines on a background thread, so the comment path never
+# waits on string formatting or stdout.
+
+correlation_id: ContextVar[Optional[str]] = ContextVar("correlation_id", default=None)
+
+# attributes every LogRecord has, anything else came from `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+# attributes set by `event` and the filters below
+_OWN_ATTRS = {"event", "fields", "correlation_id", "sampled"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def event(name: str, **fields) -> Dict[str, Any]:
+    """Builds the `extra` for a structured log call."""
+    return {"event": name, "fields": fields}
+
+
+@contextmanager
+def correlation(id: str) -> Iterator[None]:
+    """Tags every log record in this context with a correlation id, eg: the comment id of a ping."""
+    token = correlation_id.set(id)
+    try:
+        yield
+    finally:
+        correlation_id.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line json which CloudWatch Logs Insights can query."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        doc = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": getattr(record, "event", None),
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "correlation_id", None):
+            doc["correlation_id"] = record.correlation_id  # type: ignore
+        if getattr(record, "sampled", None):
+            doc["sampled"] = record.sampled  # type: ignore
+        doc.update(getattr(record, "fields", None) or {})
+        # anything passed in `extra` without going through `event`
+        doc.update({k: v for k, v in vars(record).items() if k not in _RECORD_ATTRS | _OWN_ATTRS and k not in doc})
+        if record.exc_info:
+            doc["exc"] = self.formatException(record.exc_info)
+        return json.dumps(doc, default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Stamps records with the current correlation id. Runs on the calling thread, context vars don't follow records
+    to the writer."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps 1 in n records of high volume events, recording n on the kept ones so counts can be scaled back up.
+
+    Args:
+        rates - event name to n.
+    """
+
+    def __init__(self, rates: Dict[str, int]):
+        super().__init__()
+        self.rates = rates
+        self._counters = {name: itertools.count() for name in rates}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        name = getattr(record, "event", None)
+        if name not in self.rates or record.levelno >= logging.WARNING:
+            return True
+        if next(self._counters[name]) % self.rates[name]:
+            return False
+        record.sampled = self.rates[name]
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the stdlib formats the message here, on the calling thread. records only cross threads, not processes, so
+        # leave all of that to the writer.
+        return record
+
+
+def setup(level: str = LOG_LEVEL, stream=None):
+    """Routes all logging through a queue to a json writer thread. Safe to call more than once."""
+    global _listener
+    if _listener:
+        return
+
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(JsonFormatter())
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(SamplingFilter(LOG_SAMPLE))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    for noisy in ["praw", "prawcore", "asyncprawcore", "urllib3", "botocore", "aiobotocore"]:
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(log_queue, writer)
+    _listener.start()
+    atexit.register(shutdown)
+
+
+def shutdown():
+    """Flushes anything still queued."""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,317 @@
+import asyncio
+import atexit
+import functools
+import inspect
+import json
+import logging
+import os
+import signal
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+
+from tacostats_listener.config import (
+    ASYNC_ENGINE,
+    PROFILE_DIR,
+    PROFILE_INTERVAL,
+    PROFILE_START_AFTER,
+    PROFILE_TRACEMALLOC,
+    PROFILE_WINDOW,
+    VERSION,
+)
+from tacostats_listener.logs import event
+
+log = logging.getLogger(__name__)
+
+# Opt-in profiling. A window samples the main thread's stack every PROFILE_INTERVAL seconds for PROFILE_WINDOW seconds,
+# times the stages marked with `stage`/`timed` and diffs tracemalloc snapshots taken at either end. Windows are started
+# by SIGUSR1 or PROFILE_START_AFTER seconds after startup, and end with a json report in PROFILE_DIR.
+#
+# Stages cost one global lookup while no window is open.
+
+# frames kept per stack sample
+MAX_DEPTH = 64
+# frames kept per tracemalloc trace, enough to reach back from json/botocore/praw internals into the listener
+TRACE_DEPTH = 32
+# rows in each of the report's top-n tables
+TOP = 25
+
+_window: Optional["_Window"] = None
+_window_lock = threading.Lock()
+
+
+class _NoopStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopStage()
+
+
+class _Stage:
+    def __init__(self, window: "_Window", name: str):
+        self.window = window
+        self.name = name
+
+    def __enter__(self):
+        self.mem = tracemalloc.get_traced_memory()[0] if self.window.tracing else 0
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        mem = tracemalloc.get_traced_memory()[0] - self.mem if self.window.tracing else 0
+        self.window.record(self.name, elapsed, mem)
+        return False
+
+
+def stage(name: str):
+    """Times a block, eg: `with profiling.stage("ping.regex"): ...`, while a profiling window is open.
+
+    Times are wall clock, so stages which wait on io include the wait, and under the asyncio engine include whatever
+    other tasks ran in the meantime. Stages may nest, each reports its own inclusive time.
+    """
+    window = _window
+    return _Stage(window, name) if window and window.open else _NOOP
+
+
+def timed(name: str) -> Callable:
+    """Decorator version of `stage`, works on both plain and async functions."""
+
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def install():
+    """Starts a profiling window on SIGUSR1, and PROFILE_START_AFTER seconds from now if it's set."""
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda *_: start())
+    atexit.register(stop)
+    if PROFILE_START_AFTER is not None:
+        timer = threading.Timer(PROFILE_START_AFTER, start)
+        timer.daemon = True
+        timer.start()
+
+
+def start(
+    seconds: float = PROFILE_WINDOW,
+    interval: float = PROFILE_INTERVAL,
+    trace_malloc: bool = PROFILE_TRACEMALLOC,
+    out_dir: Optional[str] = PROFILE_DIR,
+) -> bool:
+    """Opens a profiling window. Returns False if one is already open or still writing its report."""
+    global _window
+    with _window_lock:
+        if _window:
+            return False
+        window = _window = _Window(seconds, interval, trace_malloc, out_dir or tempfile.gettempdir())
+    log.info("profiling started", extra=event("profile_started", seconds=seconds, interval=interval))
+    window.start()
+    return True
+
+
+def stop() -> Optional[str]:
+    """Closes the open profiling window early, or waits for one which is already closing to write its report. Returns
+    the report path, if any."""
+    window = _window
+    if not window:
+        return None
+    window.stop()
+    return window.path
+
+
+class _Window:
+    def __init__(self, seconds: float, interval: float, trace_malloc: bool, out_dir: str):
+        self.seconds = seconds
+        self.interval = interval
+        self.out_dir = out_dir
+        self.path: Optional[str] = None
+        self.open = True
+        self.samples = 0
+        self.self_samples: Counter = Counter()
+        self.cumulative_samples: Counter = Counter()
+        self.stacks: Counter = Counter()
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.tracing = trace_malloc and not tracemalloc.is_tracing()
+        self._snapshot = None
+        self._labels: Dict[Any, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._target = threading.main_thread().ident
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        if self.tracing:
+            tracemalloc.start(TRACE_DEPTH)
+            self._snapshot = tracemalloc.take_snapshot()
+        self._started = time.monotonic()
+        self._started_at = datetime.now(tz=timezone.utc)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def record(self, name: str, elapsed: float, mem: int):
+        with self._lock:
+            stats = self.stages.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0, "net_alloc": 0})
+            stats["count"] += 1
+            stats["total"] += elapsed
+            stats["max"] = max(stats["max"], elapsed)
+            stats["net_alloc"] += mem
+
+    def _run(self):
+        global _window
+        deadline = self._started + self.seconds
+        try:
+            while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+                self._sample()
+        finally:
+            # stop handing out stages before the report is built. the window stays around until the report is
+            # written, so `stop` at exit still waits for it.
+            self.open = False
+            self._elapsed = time.monotonic() - self._started
+            # tracing slows the listener down, stop it before the slow part
+            end = tracemalloc.take_snapshot() if self.tracing else None
+            if self.tracing:
+                tracemalloc.stop()
+            try:
+                self._finish(end)
+            except Exception:
+                log.exception("failed to write profile", extra=event("profile_failed"))
+            finally:
+                _window = None
+
+    def _sample(self):
+        frame = sys._current_frames().get(self._target)
+        if frame is None:
+            return
+        stack = []
+        while frame is not None and len(stack) < MAX_DEPTH:
+            # leave out the `timed` wrappers, they'd split every stack in two
+            if frame.f_code.co_filename != __file__:
+                stack.append(self._label(frame.f_code))
+            frame = frame.f_back
+        if not stack:
+            return
+        self.samples += 1
+        self.self_samples[stack[0]] += 1
+        self.cumulative_samples.update(set(stack))
+        self.stacks[";".join(reversed(stack))] += 1
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+        return label
+
+    def _finish(self, end: Optional[tracemalloc.Snapshot]):
+        elapsed = self._elapsed
+        name = f"tacostats-profile-{os.getpid()}-{self._started_at.strftime('%Y%m%dT%H%M%S')}"
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"{name}.json")
+        collapsed = os.path.join(self.out_dir, f"{name}.collapsed")
+
+        report = {
+            "version": VERSION,
+            "engine": "asyncio" if ASYNC_ENGINE else "blocking",
+            "pid": os.getpid(),
+            "started": self._started_at.isoformat(timespec="seconds"),
+            "seconds": round(elapsed, 3),
+            "interval": self.interval,
+            "samples": self.samples,
+            "stages": self._stage_report(elapsed),
+            "top_self": self._sample_report(self.self_samples),
+            "top_cumulative": self._sample_report(self.cumulative_samples),
+            "allocations": self._allocation_report(end),
+            "collapsed": collapsed,
+        }
+        with open(collapsed, "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        self.path = path
+
+        top = list(report["stages"].items())[:5]
+        log.info(
+            "profile written",
+            extra=event("profile_written", path=path, samples=self.samples, stages={k: v["total"] for k, v in top}),
+        )
+
+    def _stage_report(self, elapsed: float) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda i: i[1]["total"], reverse=True)
+        return {
+            name: {
+                "count": int(s["count"]),
+                "total": round(s["total"], 4),
+                "mean_ms": round(s["total"] / s["count"] * 1000, 3),
+                "max_ms": round(s["max"] * 1000, 3),
+                "pct_of_window": round(s["total"] / elapsed * 100, 2) if elapsed else None,
+                # only meaningful with tracemalloc on, and interleaved with other tasks under asyncio
+                "net_alloc_kb": round(s["net_alloc"] / 1024, 1) if self.tracing else None,
+            }
+            for name, s in stages
+        }
+
+    def _sample_report(self, counts: Counter) -> List[List[Any]]:
+        return [[label, n, round(n / self.samples * 100, 2)] for label, n in counts.most_common(TOP)]
+
+    def _allocation_report(self, end: Optional[tracemalloc.Snapshot]) -> Optional[List[Dict[str, Any]]]:
+        """Allocation sites which grew the most over the window, along with the line in the listener which led to
+        them, eg: json's decoder called from `s3.read`."""
+        if end is None or self._snapshot is None:
+            return None
+        package = os.path.dirname(__file__)
+        # the sampler thread and report building both run in `_Window`. the `timed` wrappers don't, and everything
+        # allocated under them is what this report is for.
+        lines, first = inspect.getsourcelines(_Window)
+        own = range(first, first + len(lines))
+        sizes: Counter = Counter()
+        counts: Counter = Counter()
+        for diff in end.compare_to(self._snapshot, "traceback"):
+            if any(f.filename == __file__ and f.lineno in own for f in diff.traceback):
+                continue
+            # tracebacks are oldest frame first. skip the wrappers when looking for the caller, like `_sample` does.
+            site = diff.traceback[-1]
+            caller = next(
+                (f for f in reversed(diff.traceback) if f.filename.startswith(package) and f.filename != __file__), None
+            )
+            key = (_frame(site), _frame(caller) if caller else None)
+            sizes[key] += diff.size_diff
+            counts[key] += diff.count_diff
+        return [
+            {"site": site, "caller": caller, "size_kb": round(size / 1024, 1), "count": counts[site, caller]}
+            for (site, caller), size in sizes.most_common(TOP)
+            if size > 0
+        ]
+
+
+def _frame(frame: tracemalloc.Frame) -> str:
+    return f"{os.path.basename(frame.filename)}:{frame.lineno}"
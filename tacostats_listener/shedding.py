@@ -0,0 +1,86 @@
+import logging
+
+from collections import Counter
+from enum import IntEnum
+from typing import Any, Dict
+
+from tacostats_listener import util
+from tacostats_listener.config import SHED_BACKLOG, SHED_ERROR_DM_LAG, SHED_REPORT_INTERVAL
+from tacostats_listener.logs import event
+
+log = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Priority classes for incoming commands. Lower values are handled first."""
+
+    ADMIN = 0
+    OPTOUT = 1
+    PING = 2
+    # pings which can only end in an error dm, eg: from non-whitelisted users or targeting the DT
+    ERROR_DM = 3
+
+
+class LoadShedder:
+    """Tracks backlog and lag, and decides what work to drop when the listener falls behind.
+
+    Admin commands, opt-outs and valid pings are never shed. Error-dm-only comments are shed once the backlog or lag
+    passes its threshold, and error dms for stale pings are skipped. Every decision is counted in `counts`.
+
+    Args:
+        error_dm_lag - seconds after which a comment is too stale to be worth an error dm.
+        max_backlog - number of queued comments after which error-dm-only comments are shed.
+        report_interval - seconds between stats log lines.
+    """
+
+    def __init__(
+        self,
+        error_dm_lag: int = SHED_ERROR_DM_LAG,
+        max_backlog: int = SHED_BACKLOG,
+        report_interval: int = SHED_REPORT_INTERVAL,
+    ):
+        self.error_dm_lag = error_dm_lag
+        self.max_backlog = max_backlog
+        self.report_interval = report_interval
+        self.counts: Counter = Counter()
+        self.lag = 0
+        self.max_lag = 0
+        self.backlog = 0
+        self.max_backlog_seen = 0
+        self._last_report = util.now()
+
+    def admit(self, priority: Priority, lag: int, backlog: int = 0) -> bool:
+        """Records current lag and backlog, returns False if the comment should be dropped."""
+        self.lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.backlog = backlog
+        self.max_backlog_seen = max(self.max_backlog_seen, backlog)
+
+        shed = priority == Priority.ERROR_DM and (lag > self.error_dm_lag or backlog > self.max_backlog)
+        self.counts[f"{'shed' if shed else 'admitted'}.{priority.name.lower()}"] += 1
+        self.maybe_report()
+        return not shed
+
+    def allow_error_dm(self, lag: int) -> bool:
+        """Returns False if a ping is too stale to be worth an error dm."""
+        allowed = lag <= self.error_dm_lag
+        self.counts[f"error_dm.{'sent' if allowed else 'shed'}"] += 1
+        return allowed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "lag": self.lag,
+            "max_lag": self.max_lag,
+            "backlog": self.backlog,
+            "max_backlog": self.max_backlog_seen,
+            **self.counts,
+        }
+
+    def maybe_report(self):
+        """Logs stats if the report interval has passed, resetting the high-water marks."""
+        if util.now() - self._last_report < self.report_interval:
+            return
+        log.info("load stats", extra=event("load_stats", **self.stats()))
+        self._last_report = util.now()
+        self.max_lag = self.lag
+        self.max_backlog_seen = self.backlog
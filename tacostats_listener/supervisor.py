@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import random
+import time
+
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Tuple
+
+from tacostats_listener import util
+from tacostats_listener.config import (
+    POLL_BASE_DELAY,
+    POLL_MAX_DELAY,
+    RECONNECT_BASE_DELAY,
+    RECONNECT_MAX_DELAY,
+    STALL_ACTIVE_HOURS,
+    STALL_TIMEOUT,
+)
+from tacostats_listener.logs import event
+
+log = logging.getLogger(__name__)
+
+# how many comment ids to remember for de-duplicating after a reconnect. praw re-yields at most 100.
+SEEN_SIZE = 1000
+
+
+class StreamStalled(Exception):
+    """Raised when the comment stream goes quiet for too long during active hours."""
+
+    pass
+
+
+class StreamSupervisor:
+    """Keeps a comment stream alive, rebuilding it on stalls and transport errors.
+
+    Only the stream generator is rebuilt, so reddit/aws clients and caches stay warm and pings resume within seconds
+    rather than waiting on a container restart. Streams must be created with `pause_after` so quiet periods yield
+    `None` and stalls can be noticed. `pause_after=0` also turns off praw's own backoff between empty polls, so the
+    supervisor sleeps between them instead, backing off exponentially until a comment turns up. Reconnected streams
+    don't skip existing comments, so nothing posted during the outage is missed, and comments which were already
+    yielded are dropped.
+
+    A stream which ends on its own is taken as a deliberate shutdown, praw streams otherwise never end.
+
+    Args:
+        stall_timeout - seconds without a comment, during active hours, before the stream is considered stalled.
+        base_delay - reconnect delay in seconds, doubled for each consecutive failure.
+        max_delay - upper bound on the reconnect delay.
+        active_hours - (start, end) utc hours during which quiet means stalled. wraps past midnight if start > end.
+        poll_base_delay - delay in seconds after an empty poll, doubled for each consecutive empty poll.
+        poll_max_delay - upper bound on the delay between empty polls.
+    """
+
+    def __init__(
+        self,
+        stall_timeout: int = STALL_TIMEOUT,
+        base_delay: float = RECONNECT_BASE_DELAY,
+        max_delay: float = RECONNECT_MAX_DELAY,
+        active_hours: Tuple[int, int] = STALL_ACTIVE_HOURS,  # type: ignore
+        poll_base_delay: float = POLL_BASE_DELAY,
+        poll_max_delay: float = POLL_MAX_DELAY,
+    ):
+        self.stall_timeout = stall_timeout
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.active_hours = active_hours
+        self.poll_base_delay = poll_base_delay
+        self.poll_max_delay = poll_max_delay
+        self.stalls = 0
+        self.errors = 0
+        self.reconnects = 0
+        self.last_recovery = 0.0
+        self.max_recovery = 0.0
+        self._started = util.now()
+        self._last_comment = time.monotonic()
+        self._failed_at = None
+        self._attempt = 0
+        self._empty_polls = 0
+        self._seen = deque(maxlen=SEEN_SIZE)
+        self._seen_ids = set()
+
+    def comments(self, make_stream: Callable[[bool], Iterator]) -> Iterator:
+        """Yields comments from `make_stream(skip_existing)`, calling it again whenever the stream fails."""
+        skip_existing = True
+        while True:
+            try:
+                for comment in make_stream(skip_existing):
+                    if self._accept(comment, skip_existing):
+                        yield comment
+                    elif comment is None:
+                        time.sleep(self._poll_delay())
+                return
+            except Exception as e:
+                self._failed(e)
+            skip_existing = False
+            time.sleep(self._backoff())
+
+    async def acomments(self, make_stream: Callable[[bool], AsyncIterator]) -> AsyncIterator:
+        """asyncio version of `comments`."""
+        skip_existing = True
+        while True:
+            try:
+                async for comment in make_stream(skip_existing):
+                    if self._accept(comment, skip_existing):
+                        yield comment
+                    elif comment is None:
+                        await asyncio.sleep(self._poll_delay())
+                return
+            except Exception as e:
+                self._failed(e)
+            skip_existing = False
+            await asyncio.sleep(self._backoff())
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stalls": self.stalls,
+            "errors": self.errors,
+            "reconnects": self.reconnects,
+            "last_recovery": round(self.last_recovery, 3),
+            "max_recovery": round(self.max_recovery, 3),
+        }
+
+    def _accept(self, comment, skip_existing: bool) -> bool:
+        """Checks for stalls and duplicates. Returns True if the comment should be handled."""
+        # anything coming out of the stream means it's working again
+        self._recovered()
+
+        if comment is None:
+            if self._stalled():
+                raise StreamStalled(f"no comments for {time.monotonic() - self._last_comment:.0f}s")
+            self._empty_polls += 1
+            return False
+
+        self._last_comment = time.monotonic()
+        self._empty_polls = 0
+
+        # reconnected streams replay recent comments, some of which were handled or are from before we started
+        if not skip_existing and (comment.id in self._seen_ids or int(comment.created_utc) < self._started):
+            return False
+
+        if len(self._seen) == self._seen.maxlen:
+            self._seen_ids.discard(self._seen[0])
+        self._seen.append(comment.id)
+        self._seen_ids.add(comment.id)
+        return True
+
+    def _stalled(self) -> bool:
+        start, end = self.active_hours
+        hour = datetime.now(tz=timezone.utc).hour
+        active = start <= hour < end if start <= end else hour >= start or hour < end
+        return active and time.monotonic() - self._last_comment > self.stall_timeout
+
+    def _failed(self, e: Exception):
+        if isinstance(e, StreamStalled):
+            self.stalls += 1
+            log.warning("comment stream stalled, reconnecting", extra=event("stream_stalled", error=str(e)))
+        else:
+            self.errors += 1
+            log.warning("comment stream failed, reconnecting", extra=event("stream_failed", error=repr(e)))
+        if self._failed_at is None:
+            self._failed_at = time.monotonic()
+        self._empty_polls = 0
+
+    def _recovered(self):
+        if self._failed_at is None:
+            return
+        self.last_recovery = time.monotonic() - self._failed_at
+        self.max_recovery = max(self.max_recovery, self.last_recovery)
+        self.reconnects += 1
+        self._failed_at = None
+        self._attempt = 0
+        # give the new stream a full stall window
+        self._last_comment = time.monotonic()
+        log.info("comment stream recovered", extra=event("stream_recovered", **self.stats()))
+
+    def _poll_delay(self) -> float:
+        """Exponential backoff with jitter between empty polls, like praw's own when `pause_after` isn't used."""
+        delay = min(self.poll_max_delay, self.poll_base_delay * 2 ** min(self._empty_polls - 1, 16))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _backoff(self) -> float:
+        """Exponential backoff with jitter, so a flapping api isn't hit in lockstep."""
+        delay = min(self.max_delay, self.base_delay * 2 ** min(self._attempt, 16))
+        self._attempt += 1
+        return delay / 2 + random.uniform(0, delay / 2)
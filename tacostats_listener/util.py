@@ -1,4 +1,4 @@
-from datetime import datetime, timezone
-
-def now() -> int:
+from datetime import datetime, timezone
+
+def now() -> int:
     return int(datetime.now(tz=timezone.utc).timestamp())
\ No newline at end of file
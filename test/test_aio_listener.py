@@ -0,0 +1,167 @@
+import asyncio
+import json
+
+from test.utils import FakeComment, FakeReddit, FakeS3, FakeSQS, FakeSubmission
+
+from tacostats_listener import listener
+from tacostats_listener.aio_listener import AsyncListener
+from tacostats_listener.s3 import LOCK_TAG_KEY
+
+
+def _run(comments, max_pings=64, max_aws=16, s3=None):
+    reddit = FakeReddit(comments)
+    s3 = s3 or FakeS3()
+    sqs = FakeSQS()
+    asyncio.run(AsyncListener(reddit, s3, sqs, max_pings=max_pings, max_aws=max_aws).listen())
+    return reddit, s3, sqs
+
+def _locked(s3: FakeS3):
+    return [k for k, tags in s3.tags.items() if LOCK_TAG_KEY in [t['Key'] for t in tags]]
+
+def test_concurrent_pings(monkeypatch):
+    monkeypatch.setattr(listener, 'WHITELIST_ENABLED', False)
+    dt = FakeSubmission('dt')
+    comments = [FakeComment(f'c{i}', '!mystats', f'user{i}', dt) for i in range(50)]
+
+    reddit, s3, sqs = _run(comments, max_aws=8)
+
+    assert sorted(m['requester'] for m in sqs.messages) == sorted(f'user{i}' for i in range(50))
+    assert not reddit.inbox
+    assert not _locked(s3)
+    # pings overlapped, but never beyond the aws limit
+    assert 1 < s3.max_in_flight <= 8
+    # the DT is only loaded once
+    assert dt.loads == 1
+
+def test_failed_dt_load_is_retried(monkeypatch):
+    monkeypatch.setattr(listener, 'WHITELIST_ENABLED', False)
+    dt = FakeSubmission('dt')
+    load = dt.load
+    async def flaky_load():
+        await load()
+        if dt.loads == 1:
+            raise ConnectionError('reset')
+    dt.load = flaky_load
+    engine = AsyncListener(FakeReddit(), FakeS3(), FakeSQS())
+
+    async def check():
+        # both wait on the same failed load, the next check loads again
+        results = await asyncio.gather(engine._is_dt(dt), engine._is_dt(dt), return_exceptions=True)
+        assert all(isinstance(r, ConnectionError) for r in results)
+        assert await engine._is_dt(dt)
+    asyncio.run(check())
+    assert dt.loads == 2
+
+def test_same_author_is_serialized():
+    dt = FakeSubmission('dt')
+    comments = [FakeComment('c1', '!mystats', 'tacostats', dt), FakeComment('c2', '!mystats daily', 'tacostats', dt)]
+
+    reddit, s3, sqs = _run(comments)
+
+    # first ping goes through, the second hits the 2 minute throttle rather than the s3 lock
+    assert len(sqs.messages) == 1
+    assert len(reddit.inbox) == 1
+    username, subject, message = reddit.inbox[0]
+    assert username == 'tacostats' and subject == 'tacostats ping error'
+    assert 'Your last ping was only' in message
+    assert not _locked(s3)
+    # rejected pings aren't recorded, same as the blocking engine
+    assert len(json.loads(s3.objects['tacostats.json'])['pings']) == 1
+
+def test_rejected_pings():
+    dt = FakeSubmission('dt')
+    parent = FakeComment('p1', 'lorem ipsum', 'AutoModerator', dt)
+    comments = [
+        # not whitelisted
+        FakeComment('c1', '!mystats', 'fakeuser', dt),
+        # excluded parent
+        FakeComment('c2', '!stats', 'tacostats', dt, parent=parent),
+        # against the DT itself
+        FakeComment('c3', '!stats', 'inhumantsar', dt),
+    ]
+
+    reddit, _, sqs = _run(comments)
+
+    assert not sqs.messages
+    assert sorted(i[0] for i in reddit.inbox) == ['fakeuser', 'inhumantsar', 'tacostats']
+    assert all(i[1] == 'tacostats ping error' for i in reddit.inbox)
+    # parents are fetched by id, and pings against the DT don't fetch anything
+    assert reddit.fetches == ['p1']
+
+def test_skipped_comments():
+    not_dt = FakeSubmission('notdt', title='Some other thread')
+    dt = FakeSubmission('dt')
+    comments = [
+        FakeComment('c1', '!mystats', 'tacostats', not_dt),
+        FakeComment('c2', '!mystats', 'AutoModerator', dt),
+        FakeComment('c3', 'no command here', 'tacostats', dt),
+    ]
+
+    reddit, s3, sqs = _run(comments)
+
+    assert not sqs.messages and not reddit.inbox and not s3.objects
+    # comments without a command never trigger a submission load
+    assert dt.loads == 0
+
+def test_optout_and_ban():
+    dt = FakeSubmission('dt')
+    parent = FakeComment('p1', 'lorem ipsum', 'spammer', dt)
+    comments = [
+        FakeComment('c1', '!statsoptout', 'tacostats', dt),
+        FakeComment('c2', '!ban being rude', 'inhumantsar', dt, parent=parent),
+    ]
+
+    reddit, s3, sqs = _run(comments)
+
+    assert not sqs.messages
+    assert json.loads(s3.objects['tacostats.json'])['excluded']
+    assert json.loads(s3.objects['spammer.json'])['banned']
+    assert sorted((i[0], i[1]) for i in reddit.inbox) == [
+        ('spammer', 'Banned by tacostats'),
+        ('tacostats', 'tacostats opt-out'),
+    ]
+
+def test_priority_order():
+    dt = FakeSubmission('dt')
+    comments = [
+        FakeComment('c1', '!mystats', 'tacostats', dt),
+        FakeComment('c2', '!mystats', 'fakeuser', dt),
+        FakeComment('c3', '!statsoptout', 'optouter', dt),
+        FakeComment('c4', '!ban spam', 'inhumantsar', dt, parent=FakeComment('p1', 'spam', 'spammer', dt)),
+    ]
+
+    # one at a time, so handling order follows priority rather than arrival
+    reddit, _, sqs = _run(comments, max_pings=1)
+
+    assert [i[0] for i in reddit.inbox] == ['spammer', 'optouter', 'fakeuser']
+    assert [m['requester'] for m in sqs.messages] == ['tacostats']
+
+def test_load_shedding():
+    dt = FakeSubmission('dt')
+    comments = [
+        # stale error-dm-only ping is shed before any io
+        FakeComment('c1', '!mystats', 'fakeuser', dt, age=600),
+        # stale valid-looking ping is still handled, but its error dm is skipped
+        FakeComment('c2', '!stats', 'tacostats', dt, parent=FakeComment('p1', 'beep', 'AutoModerator', dt), age=600),
+        # stale opt-outs are never shed
+        FakeComment('c3', '!statsoptout', 'optouter', dt, age=600),
+    ]
+    reddit = FakeReddit(comments)
+    engine = AsyncListener(reddit, FakeS3(), FakeSQS())
+    asyncio.run(engine.listen())
+
+    assert [i[0] for i in reddit.inbox] == ['optouter']
+    assert engine.shedder.counts['shed.error_dm'] == 1
+    assert engine.shedder.counts['admitted.ping'] == 1
+    assert engine.shedder.counts['admitted.optout'] == 1
+    assert engine.shedder.counts['error_dm.shed'] == 1
+    assert engine.shedder.max_lag >= 600
+
+def test_optout_retries(monkeypatch):
+    monkeypatch.setattr(listener, 'OPTOUT_RETRY_DELAY', 0)
+    dt = FakeSubmission('dt')
+
+    reddit, s3, _ = _run([FakeComment('c1', '!statsoptout', 'optouter', dt)], s3=FakeS3(failures=3))
+
+    assert json.loads(s3.objects['optouter.json'])['excluded']
+    assert [i[0] for i in reddit.inbox] == ['optouter']
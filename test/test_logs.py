@@ -0,0 +1,70 @@
+import io
+import json
+import logging
+
+import pytest
+
+from tacostats_listener import logs
+from tacostats_listener.logs import ContextFilter, JsonFormatter, SamplingFilter, event
+
+
+@pytest.fixture
+def capture():
+    """Logger writing json through the filters to a buffer, without the queue."""
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(SamplingFilter({'comment': 3}))
+    handler.addFilter(ContextFilter())
+    logger = logging.getLogger('test_logs')
+    logger.handlers = [handler]
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    yield logger, lambda: [json.loads(l) for l in stream.getvalue().splitlines()]
+    logger.handlers = []
+    logger.propagate = True
+
+def test_json_fields(capture):
+    logger, lines = capture
+    with logs.correlation('c1'):
+        logger.info('found a ping', extra=event('ping_found', command='!mystats', days=1))
+    logger.info('plain message %s', 'args', extra={'other': 1})
+    try:
+        raise ValueError('oops')
+    except ValueError:
+        logger.exception('failed', extra=event('ping_error'))
+
+    found, plain, failed = lines()
+    assert found['event'] == 'ping_found' and found['msg'] == 'found a ping'
+    assert found['correlation_id'] == 'c1'
+    assert found['command'] == '!mystats' and found['days'] == 1
+    assert found['level'] == 'INFO' and found['logger'] == 'test_logs'
+    assert plain['msg'] == 'plain message args' and plain['other'] == 1
+    assert plain['event'] is None and 'correlation_id' not in plain
+    assert 'ValueError: oops' in failed['exc']
+
+def test_sampling(capture):
+    logger, lines = capture
+    for i in range(7):
+        logger.debug('comment received', extra=event('comment', comment_id=f'c{i}'))
+    # warnings are never sampled
+    logger.warning('comment received', extra=event('comment', comment_id='w'))
+
+    out = lines()
+    assert [l['comment_id'] for l in out] == ['c0', 'c3', 'c6', 'w']
+    assert [l.get('sampled') for l in out] == [3, 3, 3, None]
+
+def test_setup_writes_off_thread():
+    stream = io.StringIO()
+    root = logging.getLogger()
+    handlers, level = root.handlers, root.level
+    try:
+        logs.setup(level='INFO', stream=stream)
+        logging.getLogger('test_logs_setup').info('hello', extra=event('hello', n=1))
+        logging.getLogger('test_logs_setup').debug('hidden', extra=event('hidden'))
+        logs.shutdown()
+        out = [json.loads(l) for l in stream.getvalue().splitlines()]
+        assert [(l['event'], l['n']) for l in out] == [('hello', 1)]
+    finally:
+        logs.shutdown()
+        root.handlers, root.level = handlers, level
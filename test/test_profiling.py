@@ -0,0 +1,107 @@
+import asyncio
+import inspect
+import json
+import os
+import time
+
+from test.utils import FakeComment, FakeReddit, FakeS3, FakeSQS, FakeSubmission
+
+from tacostats_listener import profiling
+from tacostats_listener.aio_listener import AsyncListener
+
+
+def _busy(seconds: float):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        json.loads(json.dumps({'lorem': ['ipsum'] * 100}))
+
+@profiling.timed('test.keep_timed')
+def _keep_timed():
+    return [str(i) for i in range(20000)]
+
+def test_stages_are_free_when_closed():
+    assert profiling.stage('ping.regex') is profiling.stage('s3.read')
+    assert profiling.stop() is None
+
+def test_window_report(tmp_path):
+    @profiling.timed('test.busy')
+    def busy():
+        _busy(0.05)
+
+    assert profiling.start(seconds=10, interval=0.001, out_dir=str(tmp_path))
+    # only one window at a time
+    assert not profiling.start(out_dir=str(tmp_path))
+    for _ in range(3):
+        busy()
+    with profiling.stage('test.keep'):
+        kept = [str(i) for i in range(10000)]
+    path = profiling.stop()
+
+    report = json.loads(open(path).read())
+    assert report['samples'] > 0
+    assert report['stages']['test.busy']['count'] == 3
+    assert report['stages']['test.busy']['mean_ms'] >= 50
+    assert report['stages']['test.keep']['net_alloc_kb'] > 0
+    assert any(label == 'test_profiling.py:_busy' for label, _, _ in report['top_cumulative'])
+    assert any(a['caller'] is None and a['site'].startswith('test_profiling.py') for a in report['allocations'])
+    # the timed wrappers don't show up in stacks
+    stacks = open(report['collapsed']).read()
+    assert 'test_profiling.py:busy;test_profiling.py:_busy' in stacks
+    assert 'profiling.py:wrapper' not in stacks
+
+    # closed again
+    assert profiling.stage('test.busy') is profiling.stage('test.keep')
+    assert kept
+
+def test_timed_allocations(tmp_path):
+    lines, first = inspect.getsourcelines(_keep_timed.__wrapped__)
+    site = f"test_profiling.py:{first + next(i for i, l in enumerate(lines) if 'return' in l)}"
+
+    profiling.start(seconds=10, out_dir=str(tmp_path))
+    kept = _keep_timed()
+    report = json.loads(open(profiling.stop()).read())
+
+    # allocations under a `timed` wrapper are attributed like any other
+    allocation = next(a for a in report['allocations'] if a['site'] == site)
+    assert allocation['size_kb'] > 500
+    assert report['stages']['test.keep_timed']['net_alloc_kb'] > 500
+    assert kept
+
+def test_stop_waits_for_a_closing_window(tmp_path, monkeypatch):
+    finish = profiling._Window._finish
+    def slow_finish(self, end):
+        time.sleep(0.2)
+        finish(self, end)
+    monkeypatch.setattr(profiling._Window, '_finish', slow_finish)
+
+    profiling.start(seconds=0.01, trace_malloc=False, out_dir=str(tmp_path))
+    window = profiling._window
+    while window.open:
+        time.sleep(0.01)
+    # timed out on its own and is writing its report, like at exit
+    assert profiling.stage('test.late') is profiling.stage('test.later')
+    path = profiling.stop()
+    assert path and os.path.exists(path)
+    assert profiling._window is None
+
+def test_async_stages(tmp_path):
+    dt = FakeSubmission('dt')
+    comments = [
+        FakeComment('c1', '!mystats', 'tacostats', dt),
+        FakeComment('c2', '!stats weekly', 'inhumantsar', dt, parent=FakeComment('p1', 'lorem ipsum', 'tacostats', dt)),
+    ]
+    engine = AsyncListener(FakeReddit(comments), FakeS3(), FakeSQS())
+
+    profiling.start(seconds=10, trace_malloc=False, out_dir=str(tmp_path))
+    asyncio.run(engine.listen())
+    report = json.loads(open(profiling.stop()).read())
+
+    stages = report['stages']
+    assert stages['ping']['count'] == 2
+    assert stages['ping.regex']['count'] == 2
+    assert stages['praw.load_parent']['count'] == 1
+    assert stages['praw.load_submission']['count'] == 1
+    assert stages['ping.update_history']['count'] == 2
+    assert stages['ping.can_ping']['net_alloc_kb'] is None
+    assert report['allocations'] is None
+    assert os.path.exists(report['collapsed'])
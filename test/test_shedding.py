@@ -0,0 +1,98 @@
+import pytest
+
+from test.utils import FakeComment, FakeSubmission
+
+from tacostats_listener import listener
+from tacostats_listener.listener import _classify, _has_command
+from tacostats_listener.shedding import LoadShedder, Priority
+
+
+def test_classify():
+    dt = FakeSubmission('dt')
+    parent = FakeComment('p1', 'lorem ipsum', 'someone', dt)
+    comments = [
+        (FakeComment('c1', '!ban spam', 'inhumantsar', dt, parent=parent), Priority.ADMIN),
+        # only the admin can ban, from anyone else it isn't a command at all
+        (FakeComment('c2', '!ban spam', 'tacostats', dt, parent=parent), None),
+        (FakeComment('c3', '!statsoptout', 'fakeuser', dt), Priority.OPTOUT),
+        (FakeComment('c4', '!mystats', 'tacostats', dt), Priority.PING),
+        (FakeComment('c5', '!stats weekly', 'tacostats', dt, parent=parent), Priority.PING),
+        # not whitelisted
+        (FakeComment('c6', '!mystats', 'fakeuser', dt), Priority.ERROR_DM),
+        # targeting the DT
+        (FakeComment('c7', '!stats', 'tacostats', dt), Priority.ERROR_DM),
+    ]
+    for comment, priority in comments:
+        assert _has_command(comment) == (priority is not None), comment.id
+        if priority is not None:
+            assert _classify(comment) == priority, comment.id
+
+def test_admit():
+    shedder = LoadShedder(error_dm_lag=60, max_backlog=10)
+
+    # nothing is shed while we're keeping up
+    for priority in Priority:
+        assert shedder.admit(priority, lag=0, backlog=0)
+
+    # only error-dm-only work is shed when we're behind
+    for lag, backlog in [(61, 0), (0, 11), (600, 100)]:
+        assert shedder.admit(Priority.ADMIN, lag, backlog)
+        assert shedder.admit(Priority.OPTOUT, lag, backlog)
+        assert shedder.admit(Priority.PING, lag, backlog)
+        assert not shedder.admit(Priority.ERROR_DM, lag, backlog)
+
+    assert shedder.counts['admitted.error_dm'] == 1
+    assert shedder.counts['shed.error_dm'] == 3
+    assert shedder.counts['admitted.optout'] == 4
+    assert shedder.max_lag == 600
+    assert shedder.max_backlog_seen == 100
+
+def test_allow_error_dm():
+    shedder = LoadShedder(error_dm_lag=60)
+    assert shedder.allow_error_dm(0)
+    assert shedder.allow_error_dm(60)
+    assert not shedder.allow_error_dm(61)
+    assert shedder.stats()['error_dm.sent'] == 2
+    assert shedder.stats()['error_dm.shed'] == 1
+
+def test_blocking_engine_sheds_commands_only(monkeypatch):
+    shedder = LoadShedder(error_dm_lag=60, max_backlog=10)
+    handled = []
+    monkeypatch.setattr(listener, 'shedder', shedder)
+    monkeypatch.setattr(listener, '_handle_ping', lambda c: handled.append(('ping', c.id)))
+    monkeypatch.setattr(listener, '_optout', lambda u: handled.append(('optout', u)))
+    dt = FakeSubmission('dt')
+
+    # stale chatter, whitelisted or not, never reaches the shedder
+    for i, author in enumerate(['fakeuser', 'tacostats'] * 3):
+        listener._handle_comment(FakeComment(f'chat{i}', 'just chatting', author, dt, age=600))
+    listener._handle_comment(FakeComment('notadmin', '!ban spam', 'tacostats', dt, age=600))
+    assert not shedder.counts and not handled
+
+    listener._handle_comment(FakeComment('c1', '!mystats', 'fakeuser', dt, age=600))
+    listener._handle_comment(FakeComment('c2', '!mystats', 'tacostats', dt, age=600))
+    listener._handle_comment(FakeComment('c3', '!statsoptout', 'fakeuser', dt, age=600))
+    # not in the DT
+    listener._handle_comment(FakeComment('c4', '!mystats', 'tacostats', FakeSubmission('news', 'Some news'), age=600))
+
+    assert dict(shedder.counts) == {'shed.error_dm': 1, 'admitted.ping': 1, 'admitted.optout': 1}
+    assert handled == [('ping', 'c2'), ('optout', 'fakeuser')]
+
+def test_blocking_engine_retries_optouts(monkeypatch):
+    attempts = []
+    def optout(username):
+        attempts.append(username)
+        if len(attempts) < 3:
+            raise ConnectionError('SlowDown')
+    monkeypatch.setattr(listener, 'OPTOUT_RETRY_DELAY', 0)
+    monkeypatch.setattr(listener, '_optout', optout)
+
+    listener._handle_comment(FakeComment('c1', '!statsoptout', 'optouter', FakeSubmission('dt')))
+    assert attempts == ['optouter'] * 3
+
+    # still raises once out of attempts
+    attempts.clear()
+    monkeypatch.setattr(listener, 'OPTOUT_ATTEMPTS', 2)
+    with pytest.raises(ConnectionError):
+        listener._handle_comment(FakeComment('c2', '!statsoptout', 'optouter', FakeSubmission('dt')))
+    assert len(attempts) == 2
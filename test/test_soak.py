@@ -0,0 +1,45 @@
+import time
+
+from soak.fake_reddit import CommentFactory
+
+
+def _factory(count: int) -> CommentFactory:
+    factory = CommentFactory(rate=1000, ping_ratio=0.5)
+    time.sleep(count / 1000)
+    factory.stop()
+    return factory
+
+def test_listing_pages_forward_from_before():
+    factory = _factory(250)
+    newest = factory.listing(limit=100, before=None)
+    assert len(newest) == 100
+    assert newest[0]['data']['name'] == f"t1_{list(factory.comments)[-1]}"
+
+    # catching up from an old comment returns the next page up, newest first
+    oldest = list(factory.comments)[0]
+    page = factory.listing(limit=100, before=f't1_{oldest}')
+    ids = [i['data']['id'] for i in page]
+    assert ids == list(reversed(list(factory.comments)[1:101]))
+    assert factory.delivered == 200
+
+def test_comment_mix():
+    factory = _factory(500)
+    assert factory.pings
+    for id, kind in factory.pings.items():
+        data = factory.comments[id]['data']
+        assert '!' in data['body']
+        if kind == 'stats_dt':
+            assert data['parent_id'] == data['link_id']
+        if kind == 'ban':
+            assert data['author'] == 'inhumantsar'
+        if kind == 'bot_parent':
+            assert factory.comments[data['parent_id'][3:]]['data']['author'] == 'AutoModerator'
+
+def test_thread_holds_the_submissions_comments():
+    factory = _factory(250)
+    thread = factory.thread('dt', limit=2048)
+    assert thread and all(i['data']['link_id'] == 't3_dt' for i in thread)
+    assert thread[0]['data']['created_utc'] >= thread[-1]['data']['created_utc']
+    assert len(factory.thread('dt', limit=10)) == 10
+    # unlike listings, fetching a thread doesn't count as delivering its comments
+    assert factory.delivered == 0
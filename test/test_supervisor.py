@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+from datetime import datetime, timezone
+from test.utils import FakeComment, FakeReddit, FakeS3, FakeSQS, FakeSubmission
+
+from tacostats_listener.aio_listener import AsyncListener
+from tacostats_listener.supervisor import StreamSupervisor
+
+ALWAYS = (0, 24)
+NEVER = (0, 0)
+
+
+def _scripted(scripts):
+    """Sync stream factory playing one script per call, recording skip_existing for each."""
+    calls = []
+    def make_stream(skip_existing):
+        calls.append(skip_existing)
+        for item in scripts.pop(0):
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    return make_stream, calls
+
+def test_reconnects_on_errors_and_stalls():
+    dt = FakeSubmission('dt')
+    c1, c2, c3 = [FakeComment(f'c{i}', 'lorem ipsum', 'tacostats', dt) for i in range(1, 4)]
+    make_stream, calls = _scripted([
+        [ConnectionError('reset')],
+        [None],
+        [c1, c2, ConnectionError('reset')],
+        # reconnected streams replay recent comments
+        [c1, c2, c3],
+    ])
+    supervisor = StreamSupervisor(stall_timeout=-1, base_delay=0, poll_base_delay=0, active_hours=ALWAYS)
+
+    assert [c.id for c in supervisor.comments(make_stream)] == ['c1', 'c2', 'c3']
+    assert calls == [True, False, False, False]
+    assert supervisor.errors == 2
+    assert supervisor.stalls == 1
+    assert supervisor.reconnects == 3
+    assert supervisor.max_recovery >= supervisor.last_recovery >= 0
+
+def test_replayed_comments_from_before_start():
+    dt = FakeSubmission('dt')
+    old = FakeComment('old', 'lorem ipsum', 'tacostats', dt, age=3600)
+    new = FakeComment('new', 'lorem ipsum', 'tacostats', dt)
+    make_stream, _ = _scripted([[ConnectionError('reset')], [old, new]])
+    supervisor = StreamSupervisor(base_delay=0, poll_base_delay=0, active_hours=ALWAYS)
+
+    assert [c.id for c in supervisor.comments(make_stream)] == ['new']
+
+def test_quiet_hours_are_not_stalls():
+    make_stream, calls = _scripted([[None, None, None]])
+    supervisor = StreamSupervisor(stall_timeout=-1, base_delay=0, poll_base_delay=0, active_hours=NEVER)
+
+    assert list(supervisor.comments(make_stream)) == []
+    assert calls == [True]
+    assert supervisor.stalls == 0
+
+    # active hours wrap past midnight
+    hour = datetime.now(tz=timezone.utc).hour
+    supervisor = StreamSupervisor(stall_timeout=-1, active_hours=((hour + 1) % 24, hour))
+    assert not supervisor._stalled()
+    supervisor = StreamSupervisor(stall_timeout=-1, active_hours=(hour, (hour - 1) % 24 or 24))
+    assert supervisor._stalled()
+
+def test_empty_polls_back_off():
+    dt = FakeSubmission('dt')
+    c1 = FakeComment('c1', 'lorem ipsum', 'tacostats', dt)
+    polled = []
+    def make_stream(skip_existing):
+        for item in [None, None, None, None, c1, None]:
+            polled.append(time.monotonic())
+            yield item
+    supervisor = StreamSupervisor(poll_base_delay=0.02, poll_max_delay=0.04, active_hours=NEVER)
+
+    assert [c.id for c in supervisor.comments(make_stream)] == ['c1']
+    gaps = [b - a for a, b in zip(polled, polled[1:])]
+    # each empty poll is followed by a longer wait, up to the max
+    for gap, ceiling in zip(gaps, [0.02, 0.04, 0.04, 0.04]):
+        assert gap >= ceiling / 2
+    # and a comment resets it
+    assert supervisor._empty_polls == 1
+    assert supervisor._poll_delay() <= 0.02
+
+def test_backoff():
+    supervisor = StreamSupervisor(base_delay=1, max_delay=8)
+    delays = [supervisor._backoff() for _ in range(6)]
+    for delay, ceiling in zip(delays, [1, 2, 4, 8, 8, 8]):
+        assert ceiling / 2 <= delay <= ceiling
+
+def test_async_reconnect_keeps_clients():
+    dt = FakeSubmission('dt')
+    c1 = FakeComment('c1', '!mystats', 'tacostats', dt)
+    c2 = FakeComment('c2', '!mystats', 'inhumantsar', dt)
+    reddit = FakeReddit(streams=[[c1, ConnectionError('reset')], [None], [c1, c2]])
+    sqs = FakeSQS()
+    supervisor = StreamSupervisor(stall_timeout=-1, base_delay=0, poll_base_delay=0, active_hours=ALWAYS)
+    engine = AsyncListener(reddit, FakeS3(), sqs, supervisor=supervisor)
+
+    asyncio.run(engine.listen())
+
+    # c1 isn't handled twice and the DT was only loaded once across reconnects
+    assert sorted(m['requester'] for m in sqs.messages) == ['inhumantsar', 'tacostats']
+    assert reddit.stream.calls == [True, False, False]
+    assert supervisor.errors == 1 and supervisor.stalls == 1
+    assert dt.loads == 1
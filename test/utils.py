@@ -1,10 +1,157 @@
-import boto3
-
-from tacostats_listener.config import LOCKFILE_BUCKET
-
-# Moto automocks boto calls, these funcs help manage mock objects
-def create_bucket(): 
-    boto3.resource('s3', region_name="us-east-1").create_bucket(Bucket=LOCKFILE_BUCKET)
-
-def create_obj(key: str, tags: str): 
-    boto3.client('s3', region_name="us-east-1").put_object(Bucket=LOCKFILE_BUCKET, Key=key, Tagging=tags)
+import asyncio
+import json
+
+import boto3
+from botocore.exceptions import ClientError
+
+from tacostats_listener import util
+from tacostats_listener.config import LOCKFILE_BUCKET
+
+# Moto automocks boto calls, these funcs help manage mock objects
+def create_bucket(): 
+    boto3.resource('s3', region_name="us-east-1").create_bucket(Bucket=LOCKFILE_BUCKET)
+
+def create_obj(key: str, tags: str): 
+    boto3.client('s3', region_name="us-east-1").put_object(Bucket=LOCKFILE_BUCKET, Key=key, Tagging=tags)
+
+
+# Local stand-ins for asyncpraw and aiobotocore clients, used to run the asyncio engine without network access
+class FakeRedditor:
+    def __init__(self, reddit: "FakeReddit", name: str):
+        self._reddit = reddit
+        self.name = name
+
+    async def message(self, subject: str, message: str):
+        self._reddit.inbox.append((self.name, subject, message))
+
+class FakeSubmission:
+    def __init__(self, id: str, title: str = "Discussion Thread", author: str = "jobautomator"):
+        self.id = id
+        self.fullname = f"t3_{id}"
+        self.title = title
+        self.author = FakeRedditor(None, author)  # type: ignore
+        self.loads = 0
+
+    async def load(self):
+        self.loads += 1
+        # yield like a real request would, so concurrent checks overlap
+        await asyncio.sleep(0.01)
+
+class FakeComment:
+    def __init__(self, id: str, body: str, author: str, submission: FakeSubmission, parent=None, age: int = 0):
+        self.id = id
+        self.body = body
+        self.created_utc = float(util.now() - age)
+        self.author = FakeRedditor(None, author)  # type: ignore
+        self.submission = submission
+        self.parent = parent
+        self.parent_id = f"t1_{parent.id}" if parent else submission.fullname
+
+    async def load(self):
+        pass
+
+class FakeStream:
+    """Each call to `comments` plays the next script. Scripts hold comments, `None` pauses and exceptions to raise."""
+    def __init__(self, scripts):
+        self._scripts = list(scripts)
+        self.calls = []
+
+    async def comments(self, skip_existing: bool = False, pause_after: int = None):
+        self.calls.append(skip_existing)
+        for item in self._scripts.pop(0) if self._scripts else []:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+class FakeSubreddit:
+    def __init__(self, stream: FakeStream):
+        self.stream = stream
+
+class FakeReddit:
+    def __init__(self, comments=None, streams=None):
+        self.stream = FakeStream(streams or [comments or []])
+        self.inbox = []
+        # parents of the streamed comments, fetched by id like the real thing
+        self.comments = {
+            i.parent.id: i.parent for script in streams or [comments or []] for i in script
+            if isinstance(i, FakeComment) and i.parent
+        }
+        self.fetches = []
+
+    async def comment(self, id: str):
+        self.fetches.append(id)
+        return self.comments[id]
+
+    async def subreddit(self, name: str):
+        return FakeSubreddit(self.stream)
+
+    async def redditor(self, name: str):
+        return FakeRedditor(self, name)
+
+class FakeBody:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    async def read(self) -> bytes:
+        return self._data
+
+class FakeS3:
+    """In-memory s3 which yields to the event loop on every call and tracks how many calls overlap."""
+    def __init__(self, delay: float = 0.01, failures: int = 0):
+        self.objects = {}
+        self.tags = {}
+        self.delay = delay
+        self.failures = failures
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def _call(self):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        # fail the first n calls, like s3 having a bad moment
+        if self.failures:
+            self.failures -= 1
+            raise ClientError({'Error': {'Code': 'SlowDown'}}, 'FakeS3')
+
+    def _no_such_key(self, op: str):
+        return ClientError({'Error': {'Code': 'NoSuchKey'}}, op)
+
+    async def put_object(self, Bucket: str, Key: str, Body: str, Tagging: str = None):
+        await self._call()
+        self.objects[Key] = Body.encode()
+        if Tagging is not None:
+            self.tags[Key] = [{'Key': k, 'Value': v} for k, v in (i.split('=') for i in Tagging.split('&') if i)]
+        self.tags.setdefault(Key, [])
+
+    async def get_object(self, Bucket: str, Key: str):
+        await self._call()
+        if Key not in self.objects:
+            raise self._no_such_key('GetObject')
+        return {'Body': FakeBody(self.objects[Key])}
+
+    async def get_object_tagging(self, Bucket: str, Key: str):
+        await self._call()
+        if Key not in self.objects:
+            raise self._no_such_key('GetObjectTagging')
+        return {'TagSet': self.tags[Key]}
+
+    async def put_object_tagging(self, Bucket: str, Key: str, Tagging: dict):
+        await self._call()
+        if Key not in self.objects:
+            raise self._no_such_key('PutObjectTagging')
+        self.tags[Key] = Tagging['TagSet']
+
+    async def delete_object_tagging(self, Bucket: str, Key: str):
+        await self._call()
+        if Key not in self.objects:
+            raise self._no_such_key('DeleteObjectTagging')
+        self.tags[Key] = []
+
+class FakeSQS:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, QueueUrl: str, MessageBody: str):
+        self.messages.append(json.loads(MessageBody))